@@ -0,0 +1,90 @@
+# cython: language_level=3
+"""
+Cython binding for our custom syscall (get_proc_subtree_rusage, 472).
+
+test_resource.py imports this when it has been built, and falls back to
+ctypes otherwise. Calling syscall() from here is a plain C call, so we
+skip the libffi argument marshalling ctypes does on every sample.
+
+It also exports c_get_subtree_rusage() as a plain C function (declared in
+the generated _rusage.h; include <sys/resource.h> before it), so
+Numba/cffi code can sample in a loop without re-entering Python; see
+test_resource.get_c_sampler().
+
+Build it with:  python setup.py build_ext --inplace
+"""
+
+from libc.errno cimport errno
+from libc.string cimport memset
+
+from errno import errorcode
+
+cdef extern from "unistd.h":
+    long syscall(long number, ...) nogil
+
+# The system's own struct rusage, so the layout always matches the ABI
+# we're built for. The fields are read as long long, which is wide enough
+# for a kernel long everywhere (it's wider than long on x32).
+cdef extern from "sys/resource.h":
+    cdef struct timeval:
+        long long tv_sec
+        long long tv_usec
+
+    ctypedef struct rusage_t "struct rusage":
+        timeval ru_utime
+        timeval ru_stime
+        long long ru_maxrss
+        long long ru_ixrss
+        long long ru_idrss
+        long long ru_isrss
+        long long ru_minflt
+        long long ru_majflt
+        long long ru_nswap
+        long long ru_inblock
+        long long ru_oublock
+        long long ru_msgsnd
+        long long ru_msgrcv
+        long long ru_nsignals
+        long long ru_nvcsw
+        long long ru_nivcsw
+
+NR_GET_PROC_SUBTREE_RUSAGE = 472
+
+# The compiler's sizeof(struct rusage), which test_resource.py checks its
+# ctypes layout against
+RUSAGE_SIZE = sizeof(rusage_t)
+
+cdef public long c_get_subtree_rusage(int pid, rusage_t* out) noexcept nogil:
+    """
+    Fills `out` with the subtree rusage of `pid`.
+    Returns 0, or -errno on failure (so C callers don't need errno).
+    """
+    memset(out, 0, sizeof(rusage_t))
+    if syscall(472, pid, 0, out) < 0:
+        return -errno
+    return 0
+
+cpdef tuple get_subtree_rusage(int pid):
+    """
+    Calls the syscall for `pid` and returns the 18 rusage values as a plain
+    tuple (the timevals are flattened into sec/usec pairs).
+    Raises OSError if the syscall fails.
+    """
+    cdef rusage_t r
+    cdef long ret
+
+    # The kernel may walk a big subtree; let other threads run meanwhile
+    with nogil:
+        ret = c_get_subtree_rusage(pid, &r)
+
+    if ret < 0:
+        # Just the errno name, callers can os.strerror() it if they print it
+        raise OSError(-ret, errorcode.get(-ret, "E?"))
+
+    return (r.ru_utime.tv_sec, r.ru_utime.tv_usec,
+            r.ru_stime.tv_sec, r.ru_stime.tv_usec,
+            r.ru_maxrss, r.ru_ixrss, r.ru_idrss, r.ru_isrss,
+            r.ru_minflt, r.ru_majflt, r.ru_nswap,
+            r.ru_inblock, r.ru_oublock,
+            r.ru_msgsnd, r.ru_msgrcv, r.ru_nsignals,
+            r.ru_nvcsw, r.ru_nivcsw)
@@ -5,15 +5,14 @@ This is your main Streamlit application file, UPDATED to:
 """
 
 import streamlit as st
-import time
-import pandas as pd
-
-# Import your compiled LangGraph app
-from src.agent_graph import app 
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import threading
 
 # We still import the syscall tool directly, because the
 # *Streamlit loop* (not LangGraph) will be calling it.
-from src.tools import tool_call_syscall
+from src.tools import tool_call_syscall_batch, tool_list_processes
+from src.monitor_state import MonitorState
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -26,20 +25,23 @@ st.set_page_config(
 # This is Streamlit's "memory"
 if "process_list" not in st.session_state:
     st.session_state.process_list = "" # Caches the `ps -u` output
-if "monitoring_pids" not in st.session_state:
-    st.session_state.monitoring_pids = [] # List of PIDs to watch
-if "update_interval" not in st.session_state:
-    st.session_state.update_interval = 1.0
-if "history" not in st.session_state:
-    # Format: {pid: [list of data dicts]}
-    st.session_state.history = {}
+if "monitor" not in st.session_state:
+    # PIDs to watch, their history and the refresh interval, all in one
+    # object. Always hold monitor_lock while touching it.
+    st.session_state.monitor = MonitorState()
+    st.session_state.monitor_lock = threading.Lock()
 if "command_input" not in st.session_state:
     # This holds the text box value, allowing us to clear it
     st.session_state.command_input = ""
+if "pending_command" not in st.session_state:
+    # Future of the agent's final state while a command is being parsed
+    st.session_state.pending_command = None
+    # (kind, text) to show after the plan is applied: "toast" or "error"
+    st.session_state.agent_notice = None
 
 
 # ===================================================================
-# --- CALLBACK FUNCTIONS (Unchanged) ---
+# --- CALLBACK FUNCTIONS ---
 # ===================================================================
 
 def on_submit_clicked():
@@ -52,49 +54,92 @@ def on_submit_clicked():
         st.warning("Please enter a command.")
         return # Stop processing
     
-    # --- Call the LangGraph "brain" to get a plan ---
-    with st.spinner("Agent is thinking..."):
-        final_state = app.invoke({"command": user_input})
-        result_plan = final_state.get('result', {})
-    # -------------------------------------------------
+    # --- Hand the command to the LangGraph "brain" ---
+    # Imported here so page loads and dashboard ticks never pay for
+    # importing LangGraph; after the first submit Python has it cached.
+    from src.agent_graph import submit_command
+
+    # The graph runs in the background, so this rerun (and any click while
+    # the LLM is thinking) isn't held up by it. wait_for_agent() below
+    # picks up the plan once it's ready. A previous command that already
+    # finished still gets applied first; one still running is replaced.
+    finished_plan = take_finished_plan()
+    if finished_plan is not None:
+        apply_plan(finished_plan)
+    drop_pending_command()
+    st.session_state.pending_command = submit_command(user_input)
+
+    # Finally, clear the text box for the next command
+    st.session_state.command_input = ""
 
+def apply_plan(result_plan):
+    """
+    Carries out the plan the agent came back with. Messages go into
+    agent_notice, because this runs in a fragment just before a full rerun.
+    """
     plan_type = result_plan.get("type")
+    monitor = st.session_state.monitor
     
     if plan_type == "list":
         st.session_state.process_list = result_plan.get("data", "Error: No data from agent.")
     
     elif plan_type == "monitor":
-        st.session_state.monitoring_pids = result_plan.get("pids", [])
-        st.session_state.update_interval = result_plan.get("interval", 1.0)
-        st.session_state.history = {} # Clear old history
+        with st.session_state.monitor_lock:
+            # Clears old history too
+            monitor.reset(result_plan.get("pids", []), result_plan.get("interval", 1.0))
+            pids = monitor.pids[:]
         
-        if not st.session_state.monitoring_pids:
-            st.error("NLU couldn't find any PIDs in your command.")
+        if not pids:
+            st.session_state.agent_notice = ("error", "NLU couldn't find any PIDs in your command.")
         else:
-            st.toast(f"Starting to monitor PIDs: {st.session_state.monitoring_pids}...")
+            st.session_state.agent_notice = ("toast", f"Starting to monitor PIDs: {pids}...")
     
     elif plan_type == "stop":
-        st.session_state.monitoring_pids = []
-        st.session_state.history = {}
-        st.toast("Monitoring stopped.")
+        with st.session_state.monitor_lock:
+            monitor.reset()
+        st.session_state.agent_notice = ("toast", "Monitoring stopped.")
     
     elif plan_type == "error":
-        st.error(result_plan.get("message", "NLU agent had an error."))
+        st.session_state.agent_notice = ("error", result_plan.get("message", "NLU agent had an error."))
     
     else: # "unknown"
-        st.error(result_plan.get("message", "I didn't understand. Try 'list processes' or 'monitor <pid>'."))
-    
-    # Finally, clear the text box for the next command
-    st.session_state.command_input = ""
+        st.session_state.agent_notice = ("error", result_plan.get("message", "I didn't understand. Try 'list processes' or 'monitor <pid>'."))
+
+def take_finished_plan():
+    """
+    Returns the plan of the pending command and forgets the command, once
+    it has finished. Returns None if there is none, or it's still running.
+    """
+    future = st.session_state.pending_command
+    if future is None or not future.done():
+        return None
+    st.session_state.pending_command = None
+    try:
+        return future.result().get('result', {})
+    except Exception as e:
+        return {"type": "error", "message": f"Agent failed: {e}"}
+
+def drop_pending_command():
+    """
+    Forgets the command the agent is still working on, if any. A call
+    that is already running can't be interrupted; its plan is just
+    never applied.
+    """
+    future = st.session_state.pending_command
+    if future is not None:
+        future.cancel() # Only stops it if it hasn't started yet
+        st.session_state.pending_command = None
 
 def on_stop_clicked():
     """
     This function is called *before* the page reruns when
     the 'Stop / Clear' button is clicked.
     """
-    st.session_state.monitoring_pids = []
-    st.session_state.history = {}
+    drop_pending_command()
+    with st.session_state.monitor_lock:
+        st.session_state.monitor.reset()
     st.session_state.process_list = ""
+    tool_list_processes.clear() # Next 'list' gets a fresh `ps` output
     st.session_state.command_input = "" # Clear text box
     st.toast("Dashboard cleared.")
 
@@ -136,6 +181,32 @@ with col1:
                 on_click=on_stop_clicked 
             )
 
+    # Checks on the background command a few times a second while it's
+    # pending; only this fragment reruns until the plan is ready.
+    @st.fragment(run_every=0.25)
+    def wait_for_agent():
+        result_plan = take_finished_plan()
+        if result_plan is None:
+            if st.session_state.pending_command is not None:
+                st.info("Agent is thinking...")
+            return
+
+        apply_plan(result_plan)
+        # The process list and the dashboard live outside this fragment
+        st.rerun(scope="app")
+
+    if st.session_state.pending_command is not None:
+        wait_for_agent()
+
+    notice = st.session_state.agent_notice
+    if notice is not None:
+        st.session_state.agent_notice = None
+        kind, text = notice
+        if kind == "toast":
+            st.toast(text)
+        else:
+            st.error(text)
+
 with col2:
     st.subheader("`ps -u $USER` Output")
     st.code(st.session_state.process_list, language="bash", line_numbers=True, height=400)
@@ -145,39 +216,63 @@ with col2:
 # ===================================================================
 st.header("Live PID Dashboard")
 
-# --- THIS IS THE FIX for the UI Glitch ---
-# We create the placeholder *inside* the 'if' block.
-# This ensures it's only created once per run *after*
-# we know we are in monitoring mode.
-if st.session_state.monitoring_pids:
-    
+monitor = st.session_state.monitor
+monitor_lock = st.session_state.monitor_lock
+
+try:
+    # Set a minimum refresh time to avoid flickering
+    refresh_interval = max(0.1, float(monitor.interval))
+except (TypeError, ValueError) as e:
+    st.error(f"Invalid update interval: {e}")
+    with monitor_lock:
+        monitor.reset()
+    refresh_interval = None
+
+# The dashboard lives in a fragment that reruns on its own timer.
+# Each tick only re-executes render_dashboard(), not the whole script
+# (widgets, session_state setup, agent imports, ...).
+# The interval is read on every full-app run, so a new "monitor ... every Ns"
+# command picks up the new refresh rate.
+@st.fragment(run_every=refresh_interval)
+def render_dashboard():
+    # Take a snapshot of the PIDs, then fetch without holding the lock
+    with monitor_lock:
+        pids = monitor.pids[:]
+    if not pids:
+        # Monitoring was stopped since the last tick
+        st.rerun(scope="app")
+
+    # Streamlit (not LangGraph) calls the syscall tool directly,
+    # once for all PIDs, before we start drawing the cards
+    all_usage = tool_call_syscall_batch(pids)
+
+    # Publish the new samples and drop dead PIDs in one locked step.
+    # A callback may have reset the state meanwhile, so skip PIDs it dropped.
+    with monitor_lock:
+        for pid, usage_data in zip(pids, all_usage):
+            if pid not in monitor.pids:
+                continue
+            if usage_data and "error" not in usage_data:
+                monitor.record(pid, usage_data)
+            else:
+                # Syscall failed (e.g., process died)
+                monitor.remove(pid)
+        still_monitoring = bool(monitor.pids)
+
     # Create a container that will hold all the columns
     dashboard_container = st.container()
     
-    num_pids = len(st.session_state.monitoring_pids)
-    cols = dashboard_container.columns(num_pids)
-    
-    pids_to_remove = []
+    # Each column *is* a PID's bordered "card", so we don't need to
+    # nest an extra container inside every column on every tick
+    cols = dashboard_container.columns(len(pids), border=True)
 
-    for i, pid in enumerate(st.session_state.monitoring_pids):
+    for i, (pid, usage_data) in enumerate(zip(pids, all_usage)):
         
-        # Streamlit (not LangGraph) calls the syscall tool directly
-        usage_data = tool_call_syscall(pid)
-        
-        # Create a "card" for each PID
-        with cols[i], st.container(border=True):
+        # Fill in the "card" for each PID
+        with cols[i]:
             
             if usage_data and "error" not in usage_data:
                 
-                # --- History Calculation (Unchanged) ---
-                if pid not in st.session_state.history:
-                    st.session_state.history[pid] = []
-                
-                history = st.session_state.history[pid]
-                history.append(usage_data)
-                history = history[-100:] # Limit history
-                st.session_state.history[pid] = history
-                
                 # --- NEW: Display the 5 Raw Stats ---
                 # This is your requested dashboard
                 st.subheader(f"{usage_data.get('process_name', 'N/A')} (PID: {pid})")
@@ -192,48 +287,53 @@ if st.session_state.monitoring_pids:
                 m_cols_2[0].metric("Minor Faults", f"{usage_data['minor_page_faults']}")
                 m_cols_2[1].metric("Major Faults", f"{usage_data['major_page_faults']}")
                 
-                # --- Historical Graphs (in an expander) ---
-                with st.expander("Show Historical Graphs"):
-                    # Create a DataFrame from this PID's history
-                    df = pd.DataFrame(history)
+                # --- Historical Graphs (behind a toggle) ---
+                # An expander still runs its body when collapsed, so we use
+                # a toggle and only build the charts when it's on.
+                if st.toggle("Show Historical Graphs", key=f"g_{pid}"):
+                    # Copy this PID's history under the lock, draw without it.
+                    # Each field is already a numpy array, which Plotly takes as-is.
+                    # A callback may have dropped the PID since this tick's
+                    # fetch, in which case there is no history to draw.
+                    with monitor_lock:
+                        history = monitor.history.get(pid)
+                        hist = history.snapshot() if history is not None else None
                     
-                    st.markdown("##### CPU Usage (Cumulative s)")
-                    st.line_chart(df, y=['user_time', 'sys_time'], use_container_width=True)
-                    
-                    st.markdown("##### Max RSS (KB)")
-                    st.line_chart(df, y=['max_rss_kb'], use_container_width=True, color="#FF4B4B") # Red
-                    
-                    st.markdown("##### Page Faults (Cumulative)")
-                    st.line_chart(df, y=['minor_page_faults', 'major_page_faults'], use_container_width=True, color=["#00F", "#F00"]) # Blue/Red
+                    if hist is not None:
+                        # All three graphs go into one figure, so each tick
+                        # sends a single chart to the browser instead of three.
+                        fig = make_subplots(
+                            rows=3, cols=1, shared_xaxes=True,
+                            subplot_titles=("CPU Usage (Cumulative s)", "Max RSS (KB)", "Page Faults (Cumulative)")
+                        )
+                        fig.add_trace(go.Scatter(y=hist['user_time'], name="user_time"), row=1, col=1)
+                        fig.add_trace(go.Scatter(y=hist['sys_time'], name="sys_time"), row=1, col=1)
+                        fig.add_trace(go.Scatter(y=hist['max_rss_kb'], name="max_rss_kb", line_color="#FF4B4B"), row=2, col=1) # Red
+                        fig.add_trace(go.Scatter(y=hist['minor_page_faults'], name="minor_page_faults", line_color="#00F"), row=3, col=1) # Blue
+                        fig.add_trace(go.Scatter(y=hist['major_page_faults'], name="major_page_faults", line_color="#F00"), row=3, col=1) # Red
+                        fig.update_layout(height=600, margin=dict(t=40, b=20))
+                        
+                        st.plotly_chart(fig, use_container_width=True, key=f"chart_{pid}")
 
             else:
                 # Syscall failed (e.g., process died)
                 st.error(f"PID {pid}: {usage_data.get('error', 'Unknown Error')}")
                 st.info("Removing from monitor list.")
-                pids_to_remove.append(pid)
     
-    # --- Cleanup Loop ---
-    if pids_to_remove:
-        for pid in pids_to_remove:
-            if pid in st.session_state.monitoring_pids:
-                st.session_state.monitoring_pids.remove(pid)
-            if pid in st.session_state.history:
-                del st.session_state.history[pid]
-        
-        if not st.session_state.monitoring_pids:
-            st.rerun() # Rerun to show the "stopped" message
-
-    # If we are still monitoring, wait and rerun
-    if st.session_state.monitoring_pids:
-        try:
-            # Set a minimum sleep time to avoid flickering
-            sleep_time = max(0.1, st.session_state.update_interval)
-            time.sleep(sleep_time)
-            st.rerun()
-        except Exception as e:
-            st.error(f"Invalid update interval: {e}")
-            st.session_state.monitoring_pids = []
-            st.rerun()
+    if not still_monitoring:
+        # Only the full app knows how to show the "stopped" message,
+        # so this is the one case where we rerun everything.
+        st.rerun(scope="app")
+
+# --- THIS IS THE FIX for the UI Glitch ---
+# We only create the dashboard *inside* the 'if' block.
+# This ensures it's only created once per run *after*
+# we know we are in monitoring mode.
+with monitor_lock:
+    is_monitoring = bool(monitor.pids)
+
+if is_monitoring:
+    render_dashboard()
 
 else:
     # If not monitoring, just show a helpful message
@@ -1,101 +1,229 @@
+import errno
 import os
+import resource
 import sys
+import threading
+from collections import deque
 
-def get_children_recursive(pid):
+def build_ppid_index():
     """
-    Manually scans /proc to find all descendants of the given PID.
+    Manually scans /proc (once) and groups every PID under its parent,
+    returning a {ppid: [child_pid, ...]} dict.
     This is the "slow" part that your syscall avoids.
     """
-    children = []
+    index = {}
     try:
-        # Iterate over all directories in /proc
-        for p in os.listdir('/proc'):
-            if not p.isdigit(): 
+        for entry in os.scandir('/proc'):
+            if not entry.name.isdigit():
                 continue
-            
-            child_pid = int(p)
+
             try:
                 # Read the stat file to find the PPID (Parent PID)
-                with open(f"/proc/{child_pid}/stat", 'r') as f:
-                    # The status file format: pid (comm) state ppid ...
+                with open(f"{entry.path}/stat", 'rb') as f:
+                    # The stat file format: pid (comm) state ppid ...
                     # We split after the last ')' to handle spaces in process names
                     content = f.read()
-                    r_par_index = content.rfind(')')
-                    stats = content[r_par_index + 2:].split()
-                    
-                    # Field 1 in the split list is ppid (originally field 3)
-                    ppid = int(stats[1])
-                    
-                    if ppid == pid:
-                        children.append(child_pid)
-                        # Recursively find this child's children
-                        children.extend(get_children_recursive(child_pid))
             except (IOError, FileNotFoundError):
                 # Process might die while we scan
                 continue
+
+            r_par_index = content.rfind(b')')
+            stats = content[r_par_index + 2:].split(None, 2)
+
+            # Field 1 in the split list is ppid (originally field 3)
+            ppid = int(stats[1])
+            index.setdefault(ppid, []).append(int(entry.name))
     except Exception:
         pass
-    
-    return children
 
-def get_manual_usage(root_pid):
-    # 1. Get the list of all PIDs in the tree
-    pids = [root_pid] + get_children_recursive(root_pid)
-    
-    print(f"Scanning /proc for PIDs: {pids}")
+    return index
+
+def get_descendants(root_pid, index):
+    """
+    Walks the ppid index breadth-first to find all descendants
+    of the given PID, without touching /proc again.
+    """
+    descendants = []
+    queue = deque([root_pid])
+    while queue:
+        for child_pid in index.get(queue.popleft(), ()):
+            descendants.append(child_pid)
+            queue.append(child_pid)
 
+    return descendants
+
+# Largest read we make per /proc file: stat is a few hundred bytes and
+# status is ~1.5 KB, so 4 KB fits either.
+READ_SIZE = 4096
+
+# Open /proc file descriptors, keyed by path, kept across calls.
+# Re-reading an open procfs fd from offset 0 returns fresh contents,
+# and skips the path lookup + permission check of a new open().
+# Each thread has its own cache, so a thread only ever reads, evicts or
+# closes fds it opened itself (a shared one let one caller close fds
+# another was reading, whose numbers could then be reused for a
+# different file).
+class _FdCache(dict):
+    """One thread's {path: fd}; closes them when the thread goes away."""
+    def __del__(self):
+        for fd in self.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+_local = threading.local()
+
+def _get_fd_cache():
+    cache = getattr(_local, "fds", None)
+    if cache is None:
+        cache = _local.fds = _FdCache()
+    return cache
+
+# Most fds one thread keeps cached: 128, or an eighth of the soft fd limit
+# if that is lower, so a big subtree can't run the process out of fds.
+# Past it the least recently read fd is closed (fds of exited processes
+# age out the same way).
+def _max_cached_fds():
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return 128
+    return min(128, soft // 8)
+
+MAX_CACHED_FDS = _max_cached_fds()
+
+# What reading a /proc/<pid> file fails with once the process is gone
+_GONE_ERRNOS = (errno.ENOENT, errno.ESRCH)
+
+def _read_file(path, cache):
+    """
+    Reads one /proc file through its fd in `cache`, opening it on first
+    use. Returns the contents as bytes.
+    """
+    fd = cache.pop(path, None)
+    if fd is not None:
+        try:
+            data = os.pread(fd, READ_SIZE, 0)
+            # Re-inserted last, so the dict stays in least-recently-read order
+            cache[path] = fd
+            return data
+        except OSError:
+            # The process behind this fd exited (ESRCH); the PID may have
+            # been reused, so drop the stale fd and open the path again.
+            os.close(fd)
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        if e.errno not in (errno.EMFILE, errno.ENFILE):
+            raise
+        # Out of fds: give back the cached ones and read this file the
+        # plain way (open, read, close) instead of caching it
+        close_cached_fds()
+        with open(path, 'rb', buffering=0) as f:
+            return f.read(READ_SIZE)
+
+    try:
+        data = os.pread(fd, READ_SIZE, 0)
+    except OSError:
+        os.close(fd)
+        raise
+
+    if MAX_CACHED_FDS <= 0:
+        os.close(fd)
+        return data
+    while len(cache) >= MAX_CACHED_FDS:
+        os.close(cache.pop(next(iter(cache))))
+    cache[path] = fd
+    return data
+
+def close_cached_fds(keep=()):
+    """
+    Closes every fd cached by the calling thread whose path is not in `keep`.
+    """
+    cache = _get_fd_cache()
+    for path in list(cache):
+        if path not in keep:
+            os.close(cache.pop(path))
+
+def get_subtree_totals(pids, strict_root=False):
+    """
+    Adds up the /proc counters of the given PIDs, the same way the kernel
+    syscall aggregates a subtree. Returns (utime_ticks, stime_ticks,
+    max_rss_kb, minflt, majflt); PIDs that died meanwhile are skipped.
+    With `strict_root`, the first PID (the subtree's root) being gone
+    raises ProcessLookupError instead.
+    """
     total_utime = 0
     total_stime = 0
     max_rss_kb = 0
     total_minflt = 0
     total_majflt = 0
-    
-    clk_tck = os.sysconf('SC_CLK_TCK')
 
+    cache = _get_fd_cache()
     for pid in pids:
         try:
-            # 2. Parse /proc/[pid]/stat for CPU & Faults
-            with open(f"/proc/{pid}/stat", 'r') as f:
-                content = f.read()
-                r_par = content.rfind(')')
-                stats = content[r_par + 2:].split()
-                
-                # Mapping /proc/pid/stat fields (0-indexed after ')' split):
-                # 7: minflt, 8: cminflt, 9: majflt, 10: cmajflt
-                # 11: utime, 12: stime, 13: cutime, 14: cstime
-                
-                min_flt = int(stats[7])
-                cmin_flt = int(stats[8])
-                maj_flt = int(stats[9])
-                cmaj_flt = int(stats[10])
-                
-                utime = int(stats[11])
-                stime = int(stats[12])
-                cutime = int(stats[13])
-                cstime = int(stats[14])
-
-                # Accumulate current process + its waited-for children
-                total_minflt += (min_flt + cmin_flt)
-                total_majflt += (maj_flt + cmaj_flt)
-                total_utime += (utime + cutime)
-                total_stime += (stime + cstime)
-
-            # 3. Parse /proc/[pid]/status for Max Memory (High Water Mark)
-            with open(f"/proc/{pid}/status", 'r') as f:
-                for line in f:
-                    if line.startswith("VmHWM:"):
-                        # Format: VmHWM:    1234 kB
-                        kb = int(line.split()[1])
-                        # Logic from your kernel code: 
-                        # total->ru_maxrss = max(total->ru_maxrss, add->ru_maxrss);
-                        if kb > max_rss_kb:
-                            max_rss_kb = kb
-                        break
-                        
-        except (IOError, FileNotFoundError):
-            # Handle race condition where process dies during read
+            # Parse /proc/[pid]/stat for CPU & Faults
+            #    Stay in bytes and stop splitting after the last field we need.
+            content = _read_file(f"/proc/{pid}/stat", cache)
+        except OSError as e:
+            # Handle race condition where process dies during read;
+            # anything else (e.g. EMFILE) must not pass for a dead process
+            if e.errno not in _GONE_ERRNOS:
+                raise
+            if strict_root and pid == pids[0]:
+                raise ProcessLookupError(errno.ESRCH, os.strerror(errno.ESRCH)) from None
+            continue
+
+        r_par = content.rfind(b')')
+        stats = content[r_par + 2:].split(None, 15)
+        
+        # Mapping /proc/pid/stat fields (0-indexed after ')' split):
+        # 7: minflt, 8: cminflt, 9: majflt, 10: cmajflt
+        # 11: utime, 12: stime, 13: cutime, 14: cstime
+        
+        (min_flt, cmin_flt, maj_flt, cmaj_flt,
+         utime, stime, cutime, cstime) = map(int, stats[7:15])
+
+        # Accumulate current process + its waited-for children
+        total_minflt += (min_flt + cmin_flt)
+        total_majflt += (maj_flt + cmaj_flt)
+        total_utime += (utime + cutime)
+        total_stime += (stime + cstime)
+
+        try:
+            # Parse /proc/[pid]/status for Max Memory (High Water Mark)
+            #    VmHWM is near the top, so just search the raw buffer for it
+            #    instead of walking the file line by line.
+            status = _read_file(f"/proc/{pid}/status", cache)
+        except OSError as e:
+            if e.errno not in _GONE_ERRNOS:
+                raise
             continue
 
+        i = status.find(b"\nVmHWM:")
+        if i != -1:
+            # Format: VmHWM:    1234 kB
+            start = i + len(b"\nVmHWM:")
+            kb = int(status[start:status.find(b"\n", start)].split()[0])
+            # Logic from your kernel code: 
+            # total->ru_maxrss = max(total->ru_maxrss, add->ru_maxrss);
+            if kb > max_rss_kb:
+                max_rss_kb = kb
+
+    return total_utime, total_stime, max_rss_kb, total_minflt, total_majflt
+
+def get_manual_usage(root_pid):
+    # 1. Get the list of all PIDs in the tree
+    pids = [root_pid] + get_descendants(root_pid, build_ppid_index())
+    
+    print(f"Scanning /proc for PIDs: {pids}")
+
+    # 2. Sum up their stat + status counters
+    total_utime, total_stime, max_rss_kb, total_minflt, total_majflt = get_subtree_totals(pids)
+    
+    clk_tck = os.sysconf('SC_CLK_TCK')
+
     return {
         "utime_sec": total_utime / clk_tck,
         "stime_sec": total_stime / clk_tck,
@@ -0,0 +1,23 @@
+"""
+Builds the optional native syscall bindings used by test_resource.py:
+rusagemod (plain C extension) and _rusage (Cython).
+
+    pip install cython
+    python setup.py build_ext --inplace
+
+test_resource.py uses the fastest one that was built, or ctypes if
+neither was.
+"""
+
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+extensions = [
+    Extension("rusagemod", ["rusagemod.c"]),
+    Extension("_rusage", ["_rusage.pyx"]),
+]
+
+setup(
+    name="rusage-native",
+    ext_modules=cythonize(extensions, compiler_directives={"language_level": "3"}),
+)
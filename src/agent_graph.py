@@ -5,6 +5,8 @@ It uses LangGraph to define the NLU and routing logic.
 
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
 
 # Import your agent and tools
 from src.agent_nlu import parse_command_krutrim
@@ -99,8 +101,9 @@ def router(state: AgentState):
 #  BUILD AND COMPILE THE GRAPH
 # ==========================================================
 
+@functools.cache
 def build_graph():
-    """Builds and compiles the LangGraph."""
+    """Builds and compiles the LangGraph (only once per process)."""
     
     workflow = StateGraph(AgentState)
 
@@ -136,4 +139,16 @@ def build_graph():
     return workflow.compile()
 
 # --- Build the app and export it for main.py to use ---
-app = build_graph()
\ No newline at end of file
+app = build_graph()
+
+# Commands run on these threads, so the Streamlit script that submitted one
+# can keep handling clicks (e.g. "Stop / Clear") while the LLM is thinking.
+# Shared by every session, like the graph itself.
+_command_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent")
+
+def submit_command(command: str) -> Future:
+    """
+    Runs the graph for `command` in the background and returns at once.
+    The Future resolves to the graph's final state (see app.invoke).
+    """
+    return _command_pool.submit(app.invoke, {"command": command})
@@ -3,13 +3,26 @@ This file holds the logic for Agent A (NLU).
 It has been UPDATED to understand multiple PIDs.
 """
 
-import requests
+import aiohttp
+import asyncio
+import atexit
+import concurrent.futures
+import threading
 import os
 import sys
 import json
 import re
+import functools
 from dotenv import load_dotenv
 
+# Streamlit's cache is shared across sessions and reruns; when the agent runs
+# outside Streamlit we fall back to a plain in-process LRU cache.
+try:
+    import streamlit as st
+    _cache_nlu_result = st.cache_data(ttl=300, show_spinner=False)
+except ImportError:
+    _cache_nlu_result = functools.lru_cache(maxsize=256)
+
 # --- Krutrim API Configuration ---
 
 # 1. Get your API key from an environment variable
@@ -22,6 +35,23 @@ KRUTRIM_API_KEY = os.getenv("KRUTRIM_API_KEY")
 KRUTRIM_API_URL = 'https://cloud.olakrutrim.com/v1/chat/completions'
 KRUTRIM_MODEL = 'Qwen3-Next-80B-A3B-Instruct'
 
+KRUTRIM_TIMEOUT = 15 # Seconds for a whole API call, retries included
+
+# 2. All Krutrim HTTP calls run on one background asyncio loop, started
+#    on the first call. One aiohttp session on this loop keeps kept-alive
+#    TCP/TLS connections around, so consecutive commands skip the handshake.
+#    Gateway errors (502/503/504) are retried twice with a short backoff.
+#    (The Streamlit script itself never waits on it: commands run on
+#    agent_graph's worker threads, see submit_command.)
+_loop = None
+_loop_lock = threading.Lock()
+
+_http_session = None # aiohttp.ClientSession, created on _loop by _get_http_session()
+
+_RETRY_STATUSES = {502, 503, 504}
+_MAX_RETRIES = 2
+_RETRY_BACKOFF = 0.2
+
 # --- UPDATED SYSTEM PROMPT ---
 SYSTEM_PROMPT = """
 You are an expert NLU (Natural Language Understanding) agent for a Streamlit app.
@@ -49,11 +79,143 @@ Here are the possible intents:
     -   JSON: {"intent": "unknown", "message": "I didn't understand. Try 'list processes' or 'monitor <pid1> <pid2> ...'"}
 """
 
+class _UncacheableResult(Exception):
+    """Carries an NLU result out of the cache wrapper without caching it."""
+    def __init__(self, result: dict):
+        super().__init__(result)
+        self.result = result
+
+def _fast_path(user_input: str) -> dict | None:
+    """
+    Answers obvious commands with the local mock parser, so they need no
+    API call. Returns None when the LLM should be asked instead: the mock
+    didn't understand, or the command is one it could get wrong (mixed
+    or negated actions, an interval it can't read).
+    Shared by the sync and async entry points.
+    """
+    quick = parse_command_mock(user_input)
+    if quick["intent"] == "unknown":
+        return None
+
+    # The mock reads keywords, not meaning: leave negations ("don't list")
+    # and commands that name more than one action to the LLM
+    lowered = user_input.lower()
+    actions = [
+        "list" in lowered or "ps -u" in lowered,
+        "stop" in lowered or "clear" in lowered,
+        bool(_pid_candidates(user_input)),
+    ]
+    if _NEGATION.search(lowered) or sum(actions) > 1:
+        return None
+
+    # The mock only understands "every <N>s"; any other way of giving an
+    # interval ("every 500ms", "every 2 seconds") would silently become 1.0
+    if (quick["intent"] == "monitor_pids" and _INTERVAL_PHRASE.search(user_input)
+            and not _MOCK_INTERVAL.search(user_input)):
+        return None
+
+    print(f"[Agent A] Local fast path parsed: {quick}")
+    return quick
+
 def parse_command_krutrim(user_input: str) -> dict:
     """
     Agent A (NLU): Parses the user's command by calling the
     Krutrim LLM API.
+    Obvious commands ("list", "stop", "monitor 1234") are answered by the
+    local mock parser without any network call; the LLM is only asked
+    when the mock doesn't understand the command.
+    Successful parses are cached per command string for 5 minutes,
+    so repeating a command skips the HTTP round-trip.
     """
+    quick = _fast_path(user_input)
+    if quick is not None:
+        return quick
+
+    try:
+        return _parse_command_cached(user_input)
+    except _UncacheableResult as e:
+        return e.result
+
+@_cache_nlu_result
+def _parse_command_cached(user_input: str) -> dict:
+    """Cached layer: only successful parses are stored."""
+    parsed = _query_krutrim(user_input)
+    if parsed.get("intent") in ("unknown", "error"):
+        # Neither cache stores results of a call that raised, so an API
+        # hiccup or a misunderstood command is retried next time.
+        raise _UncacheableResult(parsed)
+    return parsed
+
+async def parse_command_krutrim_async(user_input: str) -> dict:
+    """
+    Async version of parse_command_krutrim, for code that runs on the NLU
+    loop (see submit_to_nlu_loop). It has the same local fast path, but
+    skips the result cache.
+    """
+    quick = _fast_path(user_input)
+    if quick is not None:
+        return quick
+    return await _query_krutrim_async(user_input)
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the NLU loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="krutrim-nlu-loop", daemon=True).start()
+    return _loop
+
+def submit_to_nlu_loop(coro) -> concurrent.futures.Future:
+    """Schedules a coroutine on the NLU loop; wait with .result(timeout=...)."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+def _query_krutrim(user_input: str) -> dict:
+    """
+    Sends the command to the Krutrim LLM API and returns the parsed intent.
+    The HTTP work runs on the NLU loop; this thread (an agent worker when
+    called from the app) just waits for it.
+    """
+    future = submit_to_nlu_loop(_query_krutrim_async(user_input))
+    try:
+        # The coroutine enforces KRUTRIM_TIMEOUT itself, this is a backstop
+        return future.result(timeout=KRUTRIM_TIMEOUT + 1)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        print(f"[Agent A Error] API call timed out after {KRUTRIM_TIMEOUT}s")
+        return {"intent": "error", "message": f"Krutrim API connection error: timed out after {KRUTRIM_TIMEOUT}s"}
+
+async def _get_http_session() -> aiohttp.ClientSession:
+    """Returns the shared aiohttp session (must be called on the NLU loop)."""
+    global _http_session
+    if _http_session is None:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=4),
+            headers={'Content-Type': 'application/json'}
+        )
+    return _http_session
+
+def _close_http_session():
+    """Closes the aiohttp session at exit, while the loop thread still runs."""
+    if _http_session is not None:
+        try:
+            submit_to_nlu_loop(_http_session.close()).result(timeout=1)
+        except Exception:
+            pass
+
+atexit.register(_close_http_session)
+
+async def _post_krutrim(payload: dict, headers: dict):
+    """POSTs to the API, retrying gateway errors. Returns (status, body)."""
+    session = await _get_http_session()
+    for attempt in range(_MAX_RETRIES + 1):
+        async with session.post(KRUTRIM_API_URL, json=payload, headers=headers) as response:
+            body = await response.text()
+            if response.status not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+                return response.status, body
+        await asyncio.sleep(_RETRY_BACKOFF * (2 ** attempt))
+
+async def _query_krutrim_async(user_input: str) -> dict:
     print(f"\n[Agent A] Contacting Krutrim NLU for: '{user_input}'")
 
     if not KRUTRIM_API_KEY:
@@ -61,7 +223,6 @@ def parse_command_krutrim(user_input: str) -> dict:
         return {"intent": "error", "message": "KRUTRIM_API_KEY not set on server."}
 
     headers = {
-        'Content-Type': 'application/json',
         'Authorization': f'Bearer {KRUTRIM_API_KEY}'
     }
     
@@ -75,33 +236,50 @@ def parse_command_krutrim(user_input: str) -> dict:
     }
 
     try:
-        response = requests.post(KRUTRIM_API_URL, json=payload, headers=headers, timeout=15)
-        response.raise_for_status() 
-        
-        response_data = response.json()
-        llm_output_string = response_data['choices'][0]['message']['content']
-        
-        try:
-            parsed_json = json.loads(llm_output_string)
-            if 'intent' not in parsed_json:
-                 raise ValueError("LLM response missing 'intent' key")
-            
-            print(f"[Agent A] Krutrim NLU parsed: {parsed_json}")
-            return parsed_json
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"[Agent A Error] Krutrim returned invalid JSON: {llm_output_string} ({e})")
-            # --- MOCK FALLBACK (in case Krutrim fails) ---
-            print("[Agent A] Warning: NLU failed, using local mock.")
-            return parse_command_mock(user_input)
-
-    except requests.exceptions.HTTPError as e:
-        print(f"[Agent A Error] HTTP Error from API: {e.response.status_code} {e.response.text}")
-        return {"intent": "error", "message": f"Krutrim API error (HTTP {e.response.status_code})"}
-    except requests.exceptions.RequestException as e:
+        status, body = await asyncio.wait_for(_post_krutrim(payload, headers), KRUTRIM_TIMEOUT)
+        if status >= 400:
+            print(f"[Agent A Error] HTTP Error from API: {status} {body}")
+            return {"intent": "error", "message": f"Krutrim API error (HTTP {status})"}
+        response_data = json.loads(body)
+    except asyncio.TimeoutError:
+        print(f"[Agent A Error] API call timed out after {KRUTRIM_TIMEOUT}s")
+        return {"intent": "error", "message": f"Krutrim API connection error: timed out after {KRUTRIM_TIMEOUT}s"}
+    except (aiohttp.ClientError, ValueError) as e:
         print(f"[Agent A Error] API call failed: {e}")
         return {"intent": "error", "message": f"Krutrim API connection error: {e}"}
 
+    llm_output_string = response_data['choices'][0]['message']['content']
+    
+    try:
+        parsed_json = json.loads(llm_output_string)
+        if 'intent' not in parsed_json:
+             raise ValueError("LLM response missing 'intent' key")
+        
+        print(f"[Agent A] Krutrim NLU parsed: {parsed_json}")
+        return parsed_json
+        
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"[Agent A Error] Krutrim returned invalid JSON: {llm_output_string} ({e})")
+        # --- MOCK FALLBACK (in case Krutrim fails) ---
+        print("[Agent A] Warning: NLU failed, using local mock.")
+        return parse_command_mock(user_input)
+
+# The only interval syntax the mock parser reads: "every 0.5s"
+_MOCK_INTERVAL = re.compile(r'every ([\d\.]+)s')
+
+# Anything that looks like an interval, understood by the mock or not
+_INTERVAL_PHRASE = re.compile(
+    r'\bevery\s+[\d.]+\s*[a-z]*'
+    r'|[\d.]+\s*(?:ms|msecs?|milliseconds?|s|secs?|seconds?|mins?|minutes?)\b',
+    re.IGNORECASE)
+
+_NEGATION = re.compile(r"\b(?:don'?t|do not|not|no|never|without|except)\b")
+
+def _pid_candidates(user_input: str) -> list:
+    """Numbers that could be PIDs, ignoring the ones inside an interval."""
+    text = _INTERVAL_PHRASE.sub(' ', user_input)
+    return [int(p) for p in re.findall(r'\d+', text) if len(p) > 2] # Avoid '0.5'
+
 def parse_command_mock(user_input: str) -> dict:
     """A simple mock parser in case the API fails."""
     lowered = user_input.lower()
@@ -113,12 +291,12 @@ def parse_command_mock(user_input: str) -> dict:
         return {"intent": "stop_monitoring"}
         
     if "monitor" in lowered or any(char.isdigit() for char in lowered):
-        # Find all numbers (PIDs)
-        pids = [int(p) for p in re.findall(r'\d+', user_input) if len(p) > 2] # Avoid '0.5'
+        # Find all numbers (PIDs), but not the "500" of "every 500ms"
+        pids = _pid_candidates(user_input)
         
         # Find interval
         interval = 1.0
-        match = re.search(r'every ([\d\.]+)s', user_input)
+        match = _MOCK_INTERVAL.search(user_input)
         if match:
             try:
                 interval = float(match.group(1))
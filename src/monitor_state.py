@@ -0,0 +1,86 @@
+"""
+This file holds the live dashboard's monitoring state.
+
+Everything the dashboard fragment and the button callbacks share lives in
+one MonitorState object, stored in st.session_state next to a
+threading.Lock. Any code that changes it (or needs a consistent view of
+it) must hold that lock.
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# How many samples we keep per PID for the graphs
+HISTORY_LENGTH = 100
+
+# The graphed fields of a syscall result, with a fixed dtype each
+HISTORY_FIELDS = {
+    "user_time": np.float64,
+    "sys_time": np.float64,
+    "max_rss_kb": np.int64,
+    "minor_page_faults": np.int64,
+    "major_page_faults": np.int64,
+}
+
+class HistoryBuffer:
+    """
+    Ring buffer with the last `size` samples of one PID.
+    Each field is a preallocated numpy array, so recording a sample is just
+    five element writes, with no per-sample dicts or DataFrame rebuilds.
+    """
+
+    def __init__(self, size: int = HISTORY_LENGTH):
+        self.size = size
+        self.columns = {name: np.zeros(size, dtype=dtype) for name, dtype in HISTORY_FIELDS.items()}
+        self.head = 0 # Next slot to write
+        self.filled = 0
+
+    def __len__(self):
+        return self.filled
+
+    def append(self, usage_data: dict):
+        for name, column in self.columns.items():
+            column[self.head] = usage_data[name]
+        self.head = (self.head + 1) % self.size
+        self.filled = min(self.filled + 1, self.size)
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Returns a copy of each field, oldest sample first."""
+        if self.filled < self.size:
+            return {name: column[:self.filled].copy() for name, column in self.columns.items()}
+        # np.roll returns a new array, so this is a copy as well
+        return {name: np.roll(column, -self.head) for name, column in self.columns.items()}
+
+@dataclass
+class MonitorState:
+    # The PIDs we are currently watching
+    pids: List[int] = field(default_factory=list)
+
+    # Format: {pid: HistoryBuffer (last HISTORY_LENGTH samples)}
+    history: Dict[int, HistoryBuffer] = field(default_factory=dict)
+
+    # Seconds between dashboard refreshes
+    interval: float = 1.0
+
+    def reset(self, pids=(), interval: Optional[float] = None):
+        """Starts over with a new set of PIDs (or none) and empty history."""
+        # Each PID gets one card, and its widgets are keyed by PID, so a
+        # repeated PID ("monitor 1234 1234") must only be listed once
+        self.pids = list(dict.fromkeys(pids))
+        self.history = {}
+        if interval is not None:
+            self.interval = interval
+
+    def record(self, pid: int, usage_data: dict):
+        """Appends one sample to a PID's history (oldest samples fall off)."""
+        if pid not in self.history:
+            self.history[pid] = HistoryBuffer()
+        self.history[pid].append(usage_data)
+
+    def remove(self, pid: int):
+        """Stops watching a PID and forgets its history."""
+        if pid in self.pids:
+            self.pids.remove(pid)
+        self.history.pop(pid, None)
@@ -0,0 +1,95 @@
+"""
+The ctypes side of the custom syscall, shared by src/syscall_wrapper.py
+(the app) and test_resource.py (the CLI/library): the kernel's struct
+rusage layout, the libc syscall() loader and a per-thread rusage buffer,
+so both hand the syscall a buffer of the size it actually writes.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import functools
+import platform
+import sysconfig
+import threading
+
+# The kernel's struct rusage is 18 __kernel_long_t's in a row (the two
+# timevals included). That's C long on every ABI except x32, whose longs
+# are 4 bytes but whose kernel longs are 8, so we size the fields for the
+# ABI we run on instead of hard-coding c_long.
+def _kernel_long_size():
+    if ctypes.sizeof(ctypes.c_void_p) == 8:
+        return 8
+    if "x32" in (sysconfig.get_config_var("MULTIARCH") or ""):
+        return 8
+    return 4
+
+KERNEL_LONG_SIZE = _kernel_long_size()
+KERNEL_LONG = (ctypes.c_long if ctypes.sizeof(ctypes.c_long) == KERNEL_LONG_SIZE
+               else {4: ctypes.c_int32, 8: ctypes.c_int64}[KERNEL_LONG_SIZE])
+
+# The fields after the two timevals, the one list every rusage
+# structure/tuple is generated from
+RUSAGE_LONG_FIELDS = [
+    "ru_maxrss", "ru_ixrss", "ru_idrss", "ru_isrss",
+    "ru_minflt", "ru_majflt", "ru_nswap", "ru_inblock", "ru_oublock",
+    "ru_msgsnd", "ru_msgrcv", "ru_nsignals", "ru_nvcsw", "ru_nivcsw",
+]
+
+class CTimeval(ctypes.Structure):
+    _fields_ = [("tv_sec", KERNEL_LONG),
+                ("tv_usec", KERNEL_LONG)]
+
+class CRusage(ctypes.Structure):
+    _fields_ = ([("ru_utime", CTimeval),
+                 ("ru_stime", CTimeval)] +
+                [(name, KERNEL_LONG) for name in RUSAGE_LONG_FIELDS])
+
+NR_GET_PROC_SUBTREE_RUSAGE = 472
+
+# libc's name on the platforms we know, so loading it doesn't need
+# find_library() (which shells out to ldconfig/gcc to search for it)
+_LIBC_NAMES = {"Linux": "libc.so.6", "Darwin": "libc.dylib"}
+
+@functools.cache
+def get_libc():
+    """
+    Loads libc once, on first use (the native backends never need it).
+    Raises OSError if it can't be found.
+    """
+    libc_path = _LIBC_NAMES.get(platform.system()) or ctypes.util.find_library("c")
+    if not libc_path:
+        raise OSError(errno.ENOENT, "Could not find C library (libc)")
+
+    # use_errno=True is what allows ctypes.get_errno() to work
+    return ctypes.CDLL(libc_path, use_errno=True)
+
+@functools.cache
+def get_syscall():
+    """
+    Returns libc's syscall(), typed for
+    long syscall(long syscall_num, int pid, int flags, struct rusage *usage_ptr).
+    Raises OSError if libc can't be loaded.
+    """
+    syscall = get_libc().syscall
+    syscall.argtypes = [ctypes.c_long, ctypes.c_int, ctypes.c_int, ctypes.POINTER(CRusage)]
+    syscall.restype = ctypes.c_long
+    return syscall
+
+# One CRusage buffer (and its byref) per thread, reused for every call, so
+# sampling in a loop doesn't build a new ctypes Structure + byref each
+# time. Per thread, because ctypes drops the GIL during syscall(): a buffer
+# shared between threads (Streamlit sessions, pool workers, ...) could be
+# filled by two calls at once. A thread only ever needs one.
+_local = threading.local()
+
+def get_usage_buffer():
+    """
+    Returns this thread's (CRusage, byref to it). The buffer still holds
+    the previous sample; zero it before each syscall.
+    """
+    buf = getattr(_local, "usage", None)
+    if buf is None:
+        usage = CRusage()
+        buf = _local.usage = (usage, ctypes.byref(usage))
+    return buf
@@ -6,55 +6,44 @@ exposing a single, clean Python function.
 """
 
 import ctypes
-import ctypes.util
 import errno
 import os
 import sys
-import psutil # Needed to get the process name
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Part 1: Define the C structures from your syscall ---
-class CTimeval(ctypes.Structure):
-    _fields_ = [("tv_sec", ctypes.c_long),
-                ("tv_usec", ctypes.c_long)]
-
-class CRusage(ctypes.Structure):
-    _fields_ = [("ru_utime", CTimeval),
-                ("ru_stime", CTimeval),
-                ("ru_maxrss", ctypes.c_long),
-                ("ru_ixrss", ctypes.c_long),
-                ("ru_idrss", ctypes.c_long),
-                ("ru_isrss", ctypes.c_long),
-                ("ru_minflt", ctypes.c_long),
-                ("ru_majflt", ctypes.c_long),
-                ("ru_nswap", ctypes.c_long),
-                ("ru_inblock", ctypes.c_long),
-                ("ru_oublock", ctypes.c_long),
-                ("ru_msgsnd", ctypes.c_long),
-                ("ru_msgrcv", ctypes.c_long),
-                ("ru_nsignals", ctypes.c_long),
-                ("ru_nvcsw", ctypes.c_long),
-                ("ru_nivcsw", ctypes.c_long)
-               ]
+# Sized for the kernel's longs on this ABI (not plain c_long, see x32)
+from src.rusage_layout import CRusage, CTimeval
 
 # --- Part 2: Load libc and find the syscall function ---
-NR_GET_PROC_SUBTREE_RUSAGE = 472 # Your syscall number
-syscall = None
+# Shared with test_resource.py, see src/rusage_layout.py
+from src.rusage_layout import NR_GET_PROC_SUBTREE_RUSAGE, get_syscall, get_usage_buffer
+
 try:
-    libc_path = ctypes.util.find_library("c")
-    if not libc_path:
-        print("Error: Could not find C library (libc)", file=sys.stderr)
-    else:
-        libc = ctypes.CDLL(libc_path, use_errno=True)
-        syscall = libc.syscall
-        # long syscall(long syscall_num, int pid, int flags, struct rusage *usage_ptr)
-        syscall.argtypes = [ctypes.c_long, ctypes.c_int, ctypes.c_int, ctypes.POINTER(CRusage)]
-        syscall.restype = ctypes.c_long
+    syscall = get_syscall()
 except Exception as e:
     print(f"Error loading libc or syscall: {e}", file=sys.stderr)
     syscall = None
 
 # --- Part 3: The "tool" function our app will call ---
 
+# ctypes releases the GIL during the foreign call, so syscalls for
+# different PIDs can run in parallel. Created once per process (this module
+# is imported once, unlike the Streamlit script which re-executes).
+_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rusage")
+
+def _read_comm(pid: int) -> str:
+    """
+    Reads the process name from /proc/<pid>/comm (at most 16 bytes).
+    Returns "N/A" if it can't be read (process is dead, permissions, ...);
+    the syscall can still report stats in that case.
+    """
+    try:
+        with open(f"/proc/{pid}/comm", 'rb') as f:
+            return f.read().rstrip(b'\n').decode('utf-8', 'replace')
+    except OSError:
+        return "N/A"
+
 def call_custom_syscall(pid: int) -> dict | None:
     """
     This function calls your REAL custom 'get_proc_subtree_rusage' syscall
@@ -65,25 +54,18 @@ def call_custom_syscall(pid: int) -> dict | None:
         print("Fatal: syscall function is not loaded. Cannot get usage.", file=sys.stderr)
         return {"error": "Syscall function not loaded."}
 
-    process_name = "N/A"
-    try:
-        # We use psutil just to get the friendly name
-        p = psutil.Process(pid)
-        process_name = p.name()
-    except psutil.NoSuchProcess:
-        # Process is dead, but we can still get stats
-        pass 
-    except Exception:
-        pass # Other errors (e.g., permissions)
+    # The friendly name comes straight from /proc/<pid>/comm
+    process_name = _read_comm(pid)
 
-    # 1. Create an empty C-style rusage struct
-    usage = CRusage()
+    # 1. Get this thread's C-style rusage struct, and zero it
+    usage, usage_ref = get_usage_buffer()
+    ctypes.memset(usage_ref, 0, ctypes.sizeof(CRusage))
     
     # 2. We must set errno to 0 before the call
     ctypes.set_errno(0)
     
     # 3. Call the syscall
-    ret = syscall(NR_GET_PROC_SUBTREE_RUSAGE, pid, 0, ctypes.byref(usage))
+    ret = syscall(NR_GET_PROC_SUBTREE_RUSAGE, pid, 0, usage_ref)
 
     # 4. Check for errors
     if ret < 0:
@@ -105,4 +87,23 @@ def call_custom_syscall(pid: int) -> dict | None:
         "max_rss_kb": usage.ru_maxrss,
         "minor_page_faults": usage.ru_minflt,
         "major_page_faults": usage.ru_majflt
-    }
\ No newline at end of file
+    }
+
+def call_custom_syscall_batch(pids: list[int]) -> list[dict]:
+    """
+    Gets the usage of several PIDs in one call, returning one dictionary
+    per PID, in the same order (same shape as call_custom_syscall).
+
+    The kernel currently only exposes the single-PID syscall, so this
+    still issues one syscall per PID, spread over a thread pool so the
+    total time is roughly that of the slowest PID. Callers should use this
+    anyway: it is the one place to switch over once a vector form exists.
+    """
+    # A repeated PID only needs one syscall
+    unique_pids = list(dict.fromkeys(pids))
+    if len(unique_pids) == 1:
+        results = [call_custom_syscall(unique_pids[0])]
+    else:
+        results = _pool.map(call_custom_syscall, unique_pids)
+    by_pid = dict(zip(unique_pids, results))
+    return [by_pid[pid] for pid in pids]
\ No newline at end of file
@@ -1,7 +1,7 @@
 """
 This file holds the tools for Agents B and C.
 - Agent B (Process Lister): tool_list_processes()
-- Agent C (Syscall Monitor): tool_call_syscall()
+- Agent C (Syscall Monitor): tool_call_syscall(), tool_call_syscall_batch()
 
 The complex syscall logic is now abstracted into 'syscall_wrapper.py'.
 """
@@ -11,16 +11,115 @@ import os
 import sys
 
 # --- Import our new, clean syscall function ---
-from src.syscall_wrapper import call_custom_syscall
+from src.syscall_wrapper import call_custom_syscall, call_custom_syscall_batch
+
+# Streamlit's cache is optional: the LangGraph nodes can also run from
+# a plain script, where we just call the tool directly every time.
+try:
+    import streamlit as st
+    _cache_process_list = st.cache_data(ttl=2.0, show_spinner=False)
+except ImportError:
+    def _cache_process_list(func):
+        return func
 
 # ==========================================================
 #  TOOL FOR AGENT B (PROCESS LISTER)
 # ==========================================================
 
+def _tty_name(tty_nr: int) -> str:
+    """
+    Turns the tty_nr field of /proc/<pid>/stat into the name `ps` shows.
+    """
+    major = (tty_nr >> 8) & 0xfff
+    minor = (tty_nr & 0xff) | ((tty_nr >> 12) & 0xfff00)
+    if 136 <= major <= 143:
+        return f"pts/{(major - 136) * 256 + minor}"
+    if major == 4:
+        return f"tty{minor}" if minor < 64 else f"ttyS{minor - 64}"
+    return "?"
+
+def _format_cpu_time(ticks: int, clk_tck: int) -> str:
+    """
+    Formats CPU ticks as `ps` does: [DD-]HH:MM:SS
+    """
+    seconds = ticks // clk_tck
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{days}-{time_str}" if days else time_str
+
+def tool_list_processes_native() -> str:
+    """
+    Builds the same PID/TTY/TIME/CMD table as `ps -u $USER`, but reads
+    /proc directly instead of forking a `ps` process.
+    Raises OSError if /proc is not available.
+    """
+    uid = os.geteuid()
+    clk_tck = os.sysconf('SC_CLK_TCK')
+
+    # `ps` sizes the PID column to fit the largest possible PID
+    try:
+        with open('/proc/sys/kernel/pid_max', 'rb') as f:
+            pid_width = len(f.read().strip())
+    except OSError:
+        pid_width = 5
+
+    rows = []
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+
+        try:
+            # 1. Check the owner (effective UID, like `ps -u`).
+            #    Uid: is near the top of status, so stop reading there.
+            owner = None
+            with open(f"{entry.path}/status", 'rb') as f:
+                for line in f:
+                    if line.startswith(b"Uid:"):
+                        # Format: Uid: real effective saved fs
+                        owner = int(line.split()[2])
+                        break
+            if owner != uid:
+                continue
+
+            # 2. Read stat once for comm, tty and CPU time
+            with open(f"{entry.path}/stat", 'rb') as f:
+                content = f.read()
+        except (IOError, FileNotFoundError):
+            # Process might die while we scan
+            continue
+
+        l_par = content.find(b'(')
+        r_par = content.rfind(b')')
+        comm = content[l_par + 1:r_par].decode('utf-8', 'replace')
+        stats = content[r_par + 2:].split()
+
+        # Fields (0-indexed after ')' split): 4: tty_nr, 11: utime, 12: stime
+        tty = _tty_name(int(stats[4]))
+        cpu_time = _format_cpu_time(int(stats[11]) + int(stats[12]), clk_tck)
+        rows.append((int(entry.name), tty, cpu_time, comm))
+
+    rows.sort()
+    lines = [f"{'PID':>{pid_width}} {'TTY':<8} {'TIME':>8} CMD"]
+    for pid, tty, cpu_time, comm in rows:
+        lines.append(f"{pid:>{pid_width}} {tty:<8} {cpu_time:>8} {comm}")
+    return "\n".join(lines) + "\n"
+
+@_cache_process_list
 def tool_list_processes() -> str:
     """
-    Runs `ps -u $USER` and returns the raw string output.
+    Returns the `ps -u $USER` table for the current user.
+    It is built straight from /proc, and only falls back to running
+    the real `ps` if /proc can't be read.
+    The output is cached for 2 seconds, so repeated "list" commands
+    don't rescan each time.
     """
+    try:
+        return tool_list_processes_native()
+    except OSError as e:
+        print(f"Reading /proc failed ({e}), falling back to `ps`.", file=sys.stderr)
+
     try:
         # Get the current user to run `ps -u $USER`
         user = os.environ.get("USER")
@@ -54,4 +153,11 @@ def tool_call_syscall(pid: int) -> dict | None:
     This keeps our 'tools' file clean and easy to read.
     """
     # Just call the imported function
-    return call_custom_syscall(pid)
\ No newline at end of file
+    return call_custom_syscall(pid)
+
+def tool_call_syscall_batch(pids: list[int]) -> list[dict]:
+    """
+    Same as tool_call_syscall, but for a whole list of PIDs at once.
+    Results come back in the same order as `pids`.
+    """
+    return call_custom_syscall_batch(pids)
\ No newline at end of file
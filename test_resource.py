@@ -1,88 +1,423 @@
+import argparse
 import sys
 import ctypes
-import ctypes.util
 import errno
+import functools
 import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
 
-# --- Part 1: Define the C structures in Python ---
-
-class CTimeval(ctypes.Structure):
-    _fields_ = [("tv_sec", ctypes.c_long),
-                ("tv_usec", ctypes.c_long)]
-
-class CRusage(ctypes.Structure):
-    _fields_ = [("ru_utime", CTimeval),
-                ("ru_stime", CTimeval),
-                ("ru_maxrss", ctypes.c_long),
-                ("ru_ixrss", ctypes.c_long),
-                ("ru_idrss", ctypes.c_long),
-                ("ru_isrss", ctypes.c_long),
-                ("ru_minflt", ctypes.c_long),
-                ("ru_majflt", ctypes.c_long),
-                ("ru_nswap", ctypes.c_long),
-                ("ru_inblock", ctypes.c_long),
-                ("ru_oublock", ctypes.c_long),
-                ("ru_msgsnd", ctypes.c_long),
-                ("ru_msgrcv", ctypes.c_long),
-                ("ru_nsignals", ctypes.c_long),
-                ("ru_nvcsw", ctypes.c_long),
-                ("ru_nivcsw", ctypes.c_long)
-               ]
+# Sums the /proc counters when the kernel doesn't have our syscall
+import manual_rusage
 
-# --- Part 2: Load libc and find the syscall function ---
+# The ABI-sized struct rusage layout and the libc syscall() loader,
+# shared with src/syscall_wrapper.py
+from src.rusage_layout import CRusage, CTimeval, KERNEL_LONG as _KERNEL_LONG
+from src.rusage_layout import RUSAGE_LONG_FIELDS as _RUSAGE_LONG_FIELDS
+from src.rusage_layout import NR_GET_PROC_SUBTREE_RUSAGE, get_syscall as _get_syscall
+from src.rusage_layout import get_usage_buffer as _get_usage_buffer
 
-NR_GET_PROC_SUBTREE_RUSAGE = 472
+# NumPy is only needed for get_subtree_rusage_array()
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-libc_path = ctypes.util.find_library("c")
-if not libc_path:
-    print("Error: Could not find C library (libc)", file=sys.stderr)
-    sys.exit(1)
+# Native bindings (see setup.py), fastest first: rusagemod is plain C,
+# _rusage is Cython. If neither has been built, we go through ctypes below.
+try:
+    import rusagemod
+except ImportError:
+    rusagemod = None
+try:
+    import _rusage
+except ImportError:
+    _rusage = None
 
-# use_errno=True is what allows ctypes.get_errno() to work
-libc = ctypes.CDLL(libc_path, use_errno=True)
+# --- Part 1: Define the C structures in Python ---
 
-syscall = libc.syscall
-syscall.argtypes = [ctypes.c_long, ctypes.c_int, ctypes.c_int, ctypes.POINTER(CRusage)]
-syscall.restype = ctypes.c_long
+# The native backends are compiled against the system's struct rusage, and
+# the batch/struct/numpy views read their buffers with our layout. If the
+# two disagree (e.g. a 32-bit build with _TIME_BITS=64), don't use that
+# binding; ctypes or /proc still work.
+def _layout_matches(mod):
+    size = getattr(mod, "RUSAGE_SIZE", None)
+    if size is None or size == ctypes.sizeof(CRusage):
+        return True
+    print(f"Note: not using {mod.__name__}, its struct rusage is {size} bytes "
+          f"but CRusage is {ctypes.sizeof(CRusage)}", file=sys.stderr)
+    return False
 
+if rusagemod is not None and not _layout_matches(rusagemod):
+    rusagemod = None
+if _rusage is not None and not _layout_matches(_rusage):
+    _rusage = None
 
-# --- Part 3: The main program logic ---
+# What get_subtree_rusage() returns: struct rusage with the two
+# timevals flattened, so every backend can hand back the same tuple.
+Rusage = namedtuple("Rusage", [
+    "ru_utime_sec", "ru_utime_usec", "ru_stime_sec", "ru_stime_usec",
+] + _RUSAGE_LONG_FIELDS)
 
-def main():
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <pid>", file=sys.stderr)
-        sys.exit(1)
+# --- Part 2: Load libc and find the syscall function ---
+# (the loader itself lives in src/rusage_layout.py, shared with the app)
 
-    try:
-        pid = int(sys.argv[1])
-    except ValueError:
-        print(f"Error: Invalid PID '{sys.argv[1]}'", file=sys.stderr)
-        sys.exit(1)
+# errno -> symbolic name ("ESRCH", "EPERM", ...). Failed samples carry just
+# the name, so a loop hitting dead PIDs doesn't pay for os.strerror();
+# callers that print the error look the message up themselves.
+_ERRNO_NAMES = errno.errorcode
 
-    print(f"Attempting to get subtree rusage for PID {pid}...")
+# struct rusage is 18 kernel longs in a row (the two timevals included),
+# so one compiled unpack reads a filled buffer into a tuple in C instead
+# of going through a ctypes descriptor per field
+# (ctypes' _type_ code is the matching struct format character)
+_RUSAGE_STRUCT = struct.Struct("@18" + _KERNEL_LONG._type_)
+_unpack_rusage = _RUSAGE_STRUCT.unpack_from
 
-    usage = CRusage()
+def _ctypes_get_subtree_rusage(pid):
+    usage, usage_ref = _get_usage_buffer()
+    ctypes.memset(ctypes.addressof(usage), 0, ctypes.sizeof(CRusage))
     
     # We must set errno to 0 before the call
     ctypes.set_errno(0)
     
-    ret = syscall(NR_GET_PROC_SUBTREE_RUSAGE, pid, 0, ctypes.byref(usage))
+    ret = _get_syscall()(NR_GET_PROC_SUBTREE_RUSAGE, pid, 0, usage_ref)
 
     if ret < 0:
         # Get the C error number using the ctypes function
         e = ctypes.get_errno()  # <-- THIS IS THE FIX
-        
-        # Get the error message (like perror)
-        error_message = os.strerror(e)
-        print(f"syscall(get_proc_subtree_rusage) failed: {error_message}", file=sys.stderr)
-        sys.exit(1)
-
-    print("Success!")
-    print(f"  User CPU time:   {usage.ru_utime.tv_sec}.{usage.ru_utime.tv_usec:06d} s")
-    print(f"  System CPU time: {usage.ru_stime.tv_sec}.{usage.ru_stime.tv_usec:06d} s")
-    print(f"  Max RSS:         {usage.ru_maxrss} KB")
-    print(f"  Minor pageflts:  {usage.ru_minflt}")
-    print(f"  Major pageflts:  {usage.ru_majflt}")
+        raise OSError(e, _ERRNO_NAMES.get(e, "E?"))
+
+    return Rusage._make(_unpack_rusage(usage))
+
+# --- /proc fallback, for kernels without the custom syscall ---
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+_EMPTY_RUSAGE = Rusage._make((0,) * len(Rusage._fields))
+
+def _proc_get_subtree_rusage(pid):
+    """
+    Builds the Rusage of `pid` and all its descendants from /proc instead
+    (see manual_rusage.py). Only the CPU times, max RSS and page fault
+    counts are filled in; /proc has nothing matching the other fields.
+    Safe to call from several threads at once (e.g. under
+    get_subtree_rusage_cached()): manual_rusage keeps its cached /proc
+    fds per thread, so concurrent calls never read through each other's.
+    """
+    if pid <= 0 or not os.path.isdir(f"/proc/{pid}"):
+        raise OSError(errno.ESRCH, _ERRNO_NAMES[errno.ESRCH])
+
+    pids = [pid] + manual_rusage.get_descendants(pid, manual_rusage.build_ppid_index())
+    try:
+        # strict_root: the root can still exit after the isdir() check,
+        # and that must be ESRCH, not an all-zero Rusage
+        utime, stime, maxrss, minflt, majflt = manual_rusage.get_subtree_totals(
+            pids, strict_root=True)
+    except ProcessLookupError:
+        raise OSError(errno.ESRCH, _ERRNO_NAMES[errno.ESRCH]) from None
+
+    # Clock ticks -> timeval
+    clk = _CLK_TCK
+    return _EMPTY_RUSAGE._replace(
+        ru_utime_sec=utime // clk, ru_utime_usec=utime % clk * 1_000_000 // clk,
+        ru_stime_sec=stime // clk, ru_stime_usec=stime % clk * 1_000_000 // clk,
+        ru_maxrss=maxrss, ru_minflt=minflt, ru_majflt=majflt)
+
+def _select_backend():
+    """
+    Picks how get_subtree_rusage() samples, once at import: the fastest
+    binding available, or the /proc fallback if a probe of our own PID
+    shows the kernel doesn't have the syscall (ENOSYS).
+    Returns (name, sample function).
+    """
+    if rusagemod is not None:
+        backend = ("rusagemod", rusagemod.get_subtree_rusage)
+    elif _rusage is not None:
+        _get, _make = _rusage.get_subtree_rusage, Rusage._make
+        backend = ("_rusage", lambda pid: _make(_get(pid)))
+    else:
+        backend = ("ctypes", _ctypes_get_subtree_rusage)
+
+    try:
+        backend[1](os.getpid())
+    except OSError as e:
+        if e.errno == errno.ENOSYS:
+            return "proc", _proc_get_subtree_rusage
+    return backend
+
+# BACKEND is one of "rusagemod", "_rusage", "ctypes" or "proc"
+BACKEND, _sample = _select_backend()
+
+def get_subtree_rusage(pid):
+    """
+    Returns the subtree rusage of `pid` as a Rusage tuple (the C backend
+    returns its own struct sequence, which has the same fields).
+    Raises OSError (with errno set) if the syscall fails; its strerror
+    may just be the errno name, use os.strerror(e.errno) for the message.
+    """
+    return _sample(pid)
+
+# --- get_subtree_rusage_cached(): a small TTL + LRU cache in front ---
+
+# Samples younger than CACHE_TTL seconds are reused; at most
+# CACHE_MAXSIZE PIDs are kept (least recently used go first)
+CACHE_TTL = 0.5
+CACHE_MAXSIZE = 100
+
+_cache = OrderedDict() # Format: {pid: (time.monotonic() of the sample, Rusage)}
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0}
+
+def get_subtree_rusage_cached(pid, ttl=CACHE_TTL):
+    """
+    Same as get_subtree_rusage(pid), but returns the last sample of `pid`
+    if it is less than `ttl` seconds old. Failures are never cached.
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(pid)
+        if entry is not None and now - entry[0] < ttl:
+            _cache.move_to_end(pid)
+            cache_stats["hits"] += 1
+            return entry[1]
+        cache_stats["misses"] += 1
+
+    # The syscall runs without the lock, so other PIDs aren't held up
+    try:
+        usage = get_subtree_rusage(pid)
+    except OSError:
+        invalidate(pid)
+        raise
+
+    with _cache_lock:
+        _cache[pid] = (now, usage)
+        _cache.move_to_end(pid)
+        if len(_cache) > CACHE_MAXSIZE:
+            _cache.popitem(last=False)
+    return usage
+
+def invalidate(pid=None):
+    """Drops the cached sample of `pid` (or of every PID, if None)."""
+    with _cache_lock:
+        if pid is None:
+            _cache.clear()
+        else:
+            _cache.pop(pid, None)
+
+def get_subtree_rusage_many(pids):
+    """
+    Samples every PID in `pids`. Returns (samples, errnos), one entry per
+    PID: samples[i] is a Rusage (None if that PID's syscall failed) and
+    errnos[i] is 0 or the errno it failed with.
+    With the C backend all the syscalls run in a single C loop.
+    """
+    if BACKEND == "rusagemod":
+        data, errnos = rusagemod.get_subtree_rusage_many(pids)
+        # data is one struct rusage (18 kernel longs) per PID, back to back
+        samples = [None if e else Rusage._make(values)
+                   for values, e in zip(_RUSAGE_STRUCT.iter_unpack(data), errnos)]
+        return samples, errnos
+
+    samples, errnos = [], []
+    for pid in pids:
+        try:
+            samples.append(get_subtree_rusage(pid))
+            errnos.append(0)
+        except OSError as e:
+            samples.append(None)
+            errnos.append(e.errno)
+    return samples, errnos
+
+# struct rusage as a NumPy structured dtype (one kernel long per Rusage field),
+# so a buffer of struct rusage can be viewed as an array without copying
+RUSAGE_DTYPE = (np.dtype([(name, _KERNEL_LONG._type_) for name in Rusage._fields])
+                if np is not None else None)
+
+def get_subtree_rusage_array(pids):
+    """
+    Like get_subtree_rusage_many(), but returns (samples, errnos) as NumPy
+    arrays: samples has dtype RUSAGE_DTYPE (rows of failed PIDs are zero).
+    For arithmetic across samples (deltas, watermarks) use a plain view,
+    e.g. samples.view(RUSAGE_DTYPE[0]).reshape(-1, len(Rusage._fields)).
+    """
+    if np is None:
+        raise ImportError("get_subtree_rusage_array() needs numpy")
+
+    if BACKEND == "rusagemod":
+        data, errnos = rusagemod.get_subtree_rusage_many(pids)
+        # Zero-copy (read-only) view over the struct rusage buffer
+        return np.frombuffer(data, dtype=RUSAGE_DTYPE), np.array(errnos, dtype=np.intc)
+
+    samples, errnos = get_subtree_rusage_many(pids)
+    zero = (0,) * len(Rusage._fields)
+    return (np.array([s or zero for s in samples], dtype=RUSAGE_DTYPE),
+            np.array(errnos, dtype=np.intc))
+
+def make_sampler(pid):
+    """
+    Returns a no-argument function that samples `pid` (same result and
+    errors as get_subtree_rusage(pid)), for calling in a tight loop.
+    Everything the call needs is bound as closure locals up front, so
+    each sample skips the global/attribute lookups. On the ctypes backend
+    the sampler owns its rusage buffer, so give each thread its own sampler.
+    """
+    if BACKEND == "rusagemod":
+        # partial() is C-level, so there is no Python frame per sample
+        return functools.partial(rusagemod.get_subtree_rusage, pid)
+    if BACKEND == "proc":
+        return functools.partial(_proc_get_subtree_rusage, pid)
+
+    _make = Rusage._make
+
+    if BACKEND == "_rusage":
+        _get = _rusage.get_subtree_rusage
+        def sample():
+            return _make(_get(pid))
+        return sample
+
+    # A private buffer for this sampler, not the per-thread one, so the
+    # closure needs no thread-local lookup per sample
+    _usage_buf = CRusage()
+    _sys, _NR, _ref = _get_syscall(), NR_GET_PROC_SUBTREE_RUSAGE, ctypes.byref(_usage_buf)
+    _unpack = _unpack_rusage
+    _set_errno, _get_errno = ctypes.set_errno, ctypes.get_errno
+    _memset, _addr, _size = ctypes.memset, ctypes.addressof(_usage_buf), ctypes.sizeof(CRusage)
+    _names = _ERRNO_NAMES
+
+    def sample():
+        _memset(_addr, 0, _size)
+        _set_errno(0)
+        if _sys(_NR, pid, 0, _ref) < 0:
+            e = _get_errno()
+            raise OSError(e, _names.get(e, "E?"))
+        return _make(_unpack(_usage_buf))
+    return sample
+
+@functools.cache
+def get_c_sampler():
+    """
+    Returns the Cython module's c_get_subtree_rusage(pid, CRusage*) as a
+    ctypes function, or None if _rusage hasn't been built.
+    Numba (@njit) or cffi code can call it in a loop without going through
+    Python. It returns 0, or -errno on failure.
+    """
+    if _rusage is None:
+        return None
+    fn = ctypes.CDLL(_rusage.__file__).c_get_subtree_rusage
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(CRusage)]
+    fn.restype = ctypes.c_long
+    return fn
+
+
+# --- Part 3: The main program logic ---
+
+# The whole report, filled in with one % pass and written in one go
+_REPORT = ("Success!\n"
+           "  User CPU time:   %d.%06d s\n"
+           "  System CPU time: %d.%06d s\n"
+           "  Max RSS:         %d KB\n"
+           "  Minor pageflts:  %d\n"
+           "  Major pageflts:  %d\n")
+
+def write_report(usage):
+    """Writes one sample (a Rusage tuple) to stdout."""
+    # One tuple unpack instead of an attribute lookup per field
+    (utime_sec, utime_usec, stime_sec, stime_usec, maxrss,
+     _ixrss, _idrss, _isrss, minflt, majflt) = usage[:10]
+    sys.stdout.write(_REPORT % (utime_sec, utime_usec, stime_sec, stime_usec,
+                                maxrss, minflt, majflt))
+
+# --interval mode: one compact line per sample
+_SAMPLE_HEADER = "# elapsed_s utime_s stime_s maxrss_kb minflt majflt\n"
+_SAMPLE_LINE = "%.3f %d.%06d %d.%06d %d %d %d\n"
+
+def _print_error(e):
+    # Get the error message (like perror)
+    message = os.strerror(e.errno) if e.errno else e.strerror
+    print(f"syscall(get_proc_subtree_rusage) failed: {message}", file=sys.stderr)
+
+def monitor(pid, interval, count=None):
+    """
+    Samples `pid` every `interval` seconds, `count` times (or until
+    interrupted), writing one line per sample. Everything is set up once,
+    so the loop itself only samples, formats and writes.
+    Each line is flushed as it's written, so a pipe (e.g. into a log) gets
+    it right away instead of when the buffer fills.
+    Returns the exit code: 0, or 1 if a sample failed (e.g. the PID exited).
+    A reader that goes away (`| head`) just ends the loop, with 0.
+    """
+    sample = make_sampler(pid)
+    write, flush = sys.stdout.write, sys.stdout.flush
+    line, now, sleep = _SAMPLE_LINE, time.monotonic, time.sleep
+
+    start = deadline = now()
+    n = 0
+    try:
+        write(_SAMPLE_HEADER)
+        flush()
+        while True:
+            try:
+                u = sample()
+            except OSError as e:
+                _print_error(e)
+                return 1
+            write(line % (now() - start, u[0], u[1], u[2], u[3], u[4], u[8], u[9]))
+            flush()
+
+            n += 1
+            if count is not None and n >= count:
+                return 0
+            # Sleep until the next deadline, so the schedule doesn't drift
+            deadline += interval
+            delay = deadline - now()
+            if delay > 0:
+                sleep(delay)
+    except KeyboardInterrupt:
+        return 0
+    except BrokenPipeError:
+        # Point stdout at /dev/null, so the flush at interpreter exit
+        # doesn't hit the closed pipe again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+        return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prints the resource usage of a process and all its descendants.")
+    parser.add_argument("pid", type=int, help="root PID of the subtree")
+    parser.add_argument("--interval", type=float, metavar="N",
+                        help="keep sampling every N seconds, one line per sample")
+    parser.add_argument("--count", type=int, metavar="N",
+                        help="stop after N samples (with --interval; default: until Ctrl-C)")
+    args = parser.parse_args(argv)
+
+    if args.interval is None and args.count is not None:
+        parser.error("--count needs --interval")
+    if args.interval is not None and args.interval < 0:
+        parser.error("--interval must be >= 0")
+    if args.count is not None and args.count < 1:
+        parser.error("--count must be >= 1")
+
+    pid = args.pid
+    print(f"Attempting to get subtree rusage for PID {pid}...")
+    if BACKEND == "proc":
+        print("Note: this kernel has no get_proc_subtree_rusage syscall, reading /proc instead",
+              file=sys.stderr)
+
+    if args.interval is not None:
+        return monitor(pid, args.interval, args.count)
+
+    try:
+        usage = get_subtree_rusage(pid)
+    except OSError as e:
+        _print_error(e)
+        return 1
+
+    write_report(usage)
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())